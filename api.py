@@ -1,26 +1,36 @@
 import asyncio
+import atexit
+import codecs
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import re
 from urllib.parse import urljoin, urlparse
 import os
+from queue import SimpleQueue
 import aiohttp
-from bs4 import BeautifulSoup
-from flask import Flask, request, jsonify
+from selectolax.parser import HTMLParser
+from flask import Flask, Response, request, jsonify, make_response
+from flask.json.provider import JSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_restx import Api, Resource, fields
+import orjson
 import redis
+import redis.asyncio as aioredis
 import prometheus_client
 from prometheus_client import Counter, Histogram
-import unittest
 import time
 from healthcheck import HealthCheck
-from apscheduler.schedulers.background import BackgroundScheduler
 import sys
+import threading
 
 # Prometheus metrics
 REQUESTS = Counter('crawler_requests_total', 'Total crawler requests')
 ERRORS = Counter('crawler_errors_total', 'Total crawler errors')
-CRAWL_TIME = Histogram('crawler_processing_seconds', 'Time spent processing request')
+PAGES_CRAWLED = Counter('crawler_pages_crawled_total', 'Total pages crawled')
+CRAWL_TIME = Histogram('crawler_processing_seconds', 'Time spent processing request',
+                       buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60))
 
 # Configure logging with more detail
 logging.basicConfig(
@@ -41,6 +51,15 @@ REDIS_POOL = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=0)
 def get_redis():
     return redis.Redis(connection_pool=REDIS_POOL)
 
+# Fetched pages are cached in Redis so overlapping crawls skip the network.
+# Failed fetches are cached briefly to avoid hammering dead hosts.
+HTML_CACHE_TTL = int(os.environ.get('HTML_CACHE_TTL', 3600))
+HTML_CACHE_MISS_TTL = int(os.environ.get('HTML_CACHE_MISS_TTL', 60))
+
+def get_async_redis():
+    return aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0,
+                          socket_connect_timeout=1, socket_timeout=1)
+
 # Health check function
 def redis_available():
     try:
@@ -52,6 +71,13 @@ def redis_available():
 
 port = int(os.environ.get("PORT", 8080))
 
+# Pages larger than this are truncated, and skipped outright when the
+# server announces a larger Content-Length
+MAX_PAGE_BYTES = int(os.environ.get('MAX_PAGE_BYTES', 5 * 1024 * 1024))
+
+# Number of crawl workers, i.e. the upper bound on in-flight fetches per crawl
+MAX_CONCURRENT_FETCHES = int(os.environ.get('MAX_CONCURRENT_FETCHES', 20))
+
 def is_valid(url):
     try:
         parsed = urlparse(url)
@@ -59,63 +85,242 @@ def is_valid(url):
     except Exception:
         return False
 
+# Cheap check for discovered links; is_valid's full parse is kept for user input
+_CRAWLABLE_URL_RE = re.compile(r'https?://[^/?#\s]')
+
+def is_crawlable(url):
+    return _CRAWLABLE_URL_RE.match(url) is not None
+
+# selectolax parses in C without holding the GIL, so parsing on a thread pool keeps the
+# event loop free to make progress on other fetches
+PARSE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Pages often repeat the same href (menus, pagination, "back to top"), so
+# resolved links are memoized by (base, href) instead of running urljoin for
+# every anchor
+@functools.lru_cache(maxsize=100_000)
+def _join(base, href):
+    return urljoin(base, href.strip())
+
+def parse_links(html, base_url):
+    tree = HTMLParser(html)
+    base = tree.css_first('base[href]')
+    if base is not None and base.attributes.get('href'):
+        base_url = _join(base_url, base.attributes['href'])
+
+    links = []
+    for node in tree.css('a[href]'):
+        href = node.attributes.get('href')
+        if href:
+            full_url = _join(base_url, href)
+            if is_crawlable(full_url):
+                links.append(full_url)
+    return links
+
+def _page_encoding(charset):
+    # Servers sometimes declare charsets Python does not know (e.g. utf8mb4)
+    if charset:
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
 async def fetch(session, url):
     headers = {
         'User-Agent': 'rohiitgit-WebCrawler/1.0'
     }
     try:
-        async with session.get(url, headers=headers, timeout=10) as response:
+        async with session.get(url, headers=headers) as response:
             response.raise_for_status()
-            return await response.text()
+            if 'html' not in response.headers.get('Content-Type', ''):
+                return None
+            if response.content_length is not None and response.content_length > MAX_PAGE_BYTES:
+                return None
+
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body += chunk
+                if len(body) >= MAX_PAGE_BYTES:
+                    break
+            return bytes(body[:MAX_PAGE_BYTES]).decode(_page_encoding(response.charset), errors='replace')
     except Exception as e:
         logger.error(f"Error Fetching URL {url}: {str(e)}")
         ERRORS.inc()
         return None
 
-async def crawl(url, depth, current_depth=0, visited=None):
-    start_time = time.time()
-    REQUESTS.inc()
-    
-    if visited is None:
-        visited = set()
-    if current_depth > depth or url in visited:
-        return {}
-
-    visited.add(url)
-    result = {url: [], 'depth': current_depth}
-    
+async def cached_fetch(session, cache, url):
+    key = f"html:{url}"
+    try:
+        cached = await cache.get(key)
+        if cached is not None:
+            # An empty value marks a recently failed fetch
+            return cached.decode() or None
+    except redis.RedisError as e:
+        logger.warning(f"Error reading cache for {url}: {str(e)}")
+
+    html = await fetch(session, url)
     try:
-        async with aiohttp.ClientSession() as session:
-            html = await fetch(session, url)
+        if html is None:
+            await cache.setex(key, HTML_CACHE_MISS_TTL, '')
+        else:
+            await cache.setex(key, HTML_CACHE_TTL, html)
+    except redis.RedisError as e:
+        logger.warning(f"Error writing cache for {url}: {str(e)}")
+    return html
+
+# Fetches in progress keyed by URL, so concurrent crawls that reach the same
+# page wait on a single request instead of each fetching it
+_inflight_fetches = {}
+
+async def coalesced_fetch(session, cache, url):
+    loop = asyncio.get_running_loop()
+    task = _inflight_fetches.get(url)
+    # Tasks can only be awaited from the loop that created them
+    if task is None or task.get_loop() is not loop:
+        # The fetch runs as its own task, so cancelling any one crawl that
+        # waits on it does not cut it short for the others
+        task = loop.create_task(cached_fetch(session, cache, url))
+        _inflight_fetches[url] = task
+
+        def _forget(done):
+            if _inflight_fetches.get(url) is done:
+                del _inflight_fetches[url]
+
+        task.add_done_callback(_forget)
+    return await asyncio.shield(task)
+
+async def _worker(session, cache, queue, visited, emit, depth):
+    while True:
+        url, current_depth = await queue.get()
+        page = {'url': url, 'depth': current_depth, 'links': []}
+        try:
+            html = await coalesced_fetch(session, cache, url)
             if html is None:
-                return result
-
-            soup = BeautifulSoup(html, 'html.parser')
-            tasks = []
-            
-            for link in soup.find_all('a'):
-                href = link.get('href')
-                if href:
-                    full_url = urljoin(url, href)
-                    if is_valid(full_url):
-                        result[url].append(full_url)
-                        if current_depth < depth:
-                            logger.info(f'Crawling {full_url}...')
-                            tasks.append(crawl(full_url, depth, current_depth + 1, visited))
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for res in results:
-                if not isinstance(res, Exception):
-                    result.update(res)
+                continue
+
+            loop = asyncio.get_running_loop()
+            links = await loop.run_in_executor(PARSE_POOL, parse_links, html, url)
+            page['links'] = links
+            if current_depth < depth:
+                for full_url in links:
+                    if full_url not in visited:
+                        visited.add(full_url)
+                        logger.info(f'Crawling {full_url}...')
+                        queue.put_nowait((full_url, current_depth + 1))
+        except Exception as e:
+            logger.error(f"Error crawling {url}: {str(e)}")
+            ERRORS.inc()
+        finally:
+            emit(page)
+            queue.task_done()
+
+# All crawls run on one long-lived event loop in a background thread, which
+# owns the shared HTTP session and async Redis client. The loop is started on
+# first use rather than at import, and restarted in a forked worker, which
+# inherits the loop but not the thread running it.
+_crawl_loop = None
+_crawl_thread = None
+_crawl_loop_pid = None
+_crawl_loop_lock = threading.Lock()
+
+_session = None
+_cache = None
+
+def get_crawl_loop():
+    global _crawl_loop, _crawl_thread, _crawl_loop_pid, _session, _cache
+    with _crawl_loop_lock:
+        if (_crawl_loop is None or _crawl_loop_pid != os.getpid()
+                or not _crawl_thread.is_alive()):
+            _crawl_loop = asyncio.new_event_loop()
+            _crawl_thread = threading.Thread(target=_crawl_loop.run_forever,
+                                             name='crawl-loop', daemon=True)
+            _crawl_thread.start()
+            _crawl_loop_pid = os.getpid()
+            # Clients are bound to the loop that created them
+            _session = None
+            _cache = None
+        return _crawl_loop
+
+async def _close_clients():
+    if _session is not None and not _session.closed:
+        await _session.close()
+    if _cache is not None:
+        await _cache.aclose()
+
+@atexit.register
+def _shutdown_crawl_loop():
+    if _crawl_loop is None or _crawl_loop_pid != os.getpid() or not _crawl_thread.is_alive():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close_clients(), _crawl_loop).result(timeout=5)
     except Exception as e:
-        logger.error(f"Error crawling {url}: {str(e)}")
-        ERRORS.inc()
+        logger.warning(f"Error closing crawl clients: {str(e)}")
+    _crawl_loop.call_soon_threadsafe(_crawl_loop.stop)
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        # Reused across crawls so connections and DNS lookups are shared
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=8,
+                                         use_dns_cache=True, ttl_dns_cache=300,
+                                         enable_cleanup_closed=True)
+        # The total limit bounds servers that trickle bytes just fast
+        # enough to never trip the read timeout
+        timeout = aiohttp.ClientTimeout(total=30, sock_connect=5, sock_read=10)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = get_async_redis()
+    return _cache
+
+async def crawl(url, depth, emit):
+    session = _get_session()
+    cache = _get_cache()
+
+    # Breadth-first crawl drained by a fixed pool of workers, which also
+    # bounds the number of in-flight fetches
+    queue = asyncio.Queue()
+    visited = {url}
+    queue.put_nowait((url, 0))
+
+    workers = [
+        asyncio.create_task(_worker(session, cache, queue, visited, emit, depth))
+        for _ in range(MAX_CONCURRENT_FETCHES)
+    ]
+    try:
+        await queue.join()
     finally:
-        CRAWL_TIME.observe(time.time() - start_time)
-    
-    return result
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+def stream_crawl(url, depth):
+    # Pages are handed from the crawl loop to the response thread as each
+    # one completes; None marks the end of the crawl
+    pages = SimpleQueue()
+    future = asyncio.run_coroutine_threadsafe(crawl(url, depth, pages.put), get_crawl_loop())
+    future.add_done_callback(lambda _: pages.put(None))
+    try:
+        while (page := pages.get()) is not None:
+            yield page
+        future.result()
+    finally:
+        # Stop crawling if the client disconnects mid-stream
+        future.cancel()
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Initialize health check
 health = HealthCheck()
@@ -130,6 +335,13 @@ api = Api(app, version='1.0',
          description='A production-grade web crawler API with monitoring and documentation',
          doc='/swagger')
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    # Crawl results are streamed as NDJSON; this covers error bodies and swagger.json
+    response = make_response(orjson.dumps(data), code)
+    response.headers.extend(headers or {})
+    return response
+
 ns = api.namespace('api', 'Web Crawler API Documentation')
 
 limiter = Limiter(
@@ -144,19 +356,13 @@ crawler_input = api.model('CrawlerInput', {
     'depth': fields.Integer(required=True, description='The depth of the crawl', default=1, min=1)
 })
 
-crawler_response = api.model('CrawlerResponse', {
-    'results': fields.Raw(description='The crawled URLs and their links'),
-    'status': fields.String(description='Status of the crawl'),
-    'execution_time': fields.Float(description='Time taken to execute the crawl')
-})
-
 @ns.route('/crawl')
 class CrawlAPI(Resource):
     @limiter.limit("10 per minute")
     @ns.expect(crawler_input)
-    @ns.marshal_with(crawler_response)
+    @ns.produces(['application/x-ndjson'])
     @ns.doc(responses={
-        200: 'Success',
+        200: 'Success, streamed as one {url, depth, links} JSON object per line',
         400: 'Invalid input',
         429: 'Too many requests',
         500: 'Server error'
@@ -165,11 +371,17 @@ class CrawlAPI(Resource):
         """
         Crawl a website to the specified depth
         
-        Returns crawled URLs and their links in a tree structure
+        Streams each crawled page with its depth and links as newline-delimited JSON
         """
         start_time = time.time()
-        data = request.json
-        url = data['url']
+        REQUESTS.inc()
+        try:
+            data = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            api.abort(400, 'Invalid JSON body')
+        if not isinstance(data, dict):
+            api.abort(400, 'Invalid JSON body')
+        url = data.get('url')
         depth = data.get('depth', 1)
 
         if not url or not is_valid(url):
@@ -177,22 +389,19 @@ class CrawlAPI(Resource):
         if not isinstance(depth, int) or depth < 1:
             api.abort(400, 'Invalid depth')
 
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            results = loop.run_until_complete(crawl(url, depth))
-            loop.close()
-            
-            execution_time = time.time() - start_time
-            return {
-                'results': results,
-                'status': 'success',
-                'execution_time': execution_time
-            }
-        except Exception as e:
-            logger.error(f"An error occurred: {str(e)}")
-            ERRORS.inc()
-            api.abort(500, f"An error occurred: {str(e)}")
+        def generate():
+            try:
+                for page in stream_crawl(url, depth):
+                    PAGES_CRAWLED.inc()
+                    yield orjson.dumps(page) + b'\n'
+            except Exception as e:
+                # Headers are already sent, so the error can only be logged
+                logger.error(f"An error occurred: {str(e)}")
+                ERRORS.inc()
+            finally:
+                CRAWL_TIME.observe(time.time() - start_time)
+
+        return Response(generate(), mimetype='application/x-ndjson')
 
 # Background task to check system health
 def check_system_health():
@@ -201,35 +410,14 @@ def check_system_health():
     if not redis_status:
         logger.error("Redis connection failed during health check")
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(check_system_health, 'interval', minutes=5)
-scheduler.start()
-
-# Test cases
-class TestCrawler(unittest.TestCase):
-    def setUp(self):
-        self.app = app.test_client()
-        
-    def test_valid_url(self):
-        response = self.app.post('/api/crawl',
-                               json={'url': 'http://example.com', 'depth': 1})
-        self.assertEqual(response.status_code, 200)
-        
-    def test_invalid_url(self):
-        response = self.app.post('/api/crawl',
-                               json={'url': 'invalid-url', 'depth': 1})
-        self.assertEqual(response.status_code, 400)
-        
-    def test_invalid_depth(self):
-        response = self.app.post('/api/crawl',
-                               json={'url': 'http://example.com', 'depth': 0})
-        self.assertEqual(response.status_code, 400)
+# Only one process per deployment should run the periodic health check
+if os.environ.get('RUN_SCHEDULER') == '1':
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(check_system_health, 'interval', minutes=5)
+    scheduler.start()
 
 if __name__ == '__main__':
-    # Run tests if in test mode
-    if os.environ.get('FLASK_ENV') == 'test':
-        unittest.main()
-    else:
-        # Start the application
-        from waitress import serve
-        serve(app, host='0.0.0.0', port=port)
+    # Start the application
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=port)
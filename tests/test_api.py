@@ -0,0 +1,173 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import orjson
+
+import api
+from api import app
+
+class TestCrawler(unittest.TestCase):
+    def setUp(self):
+        # The rate limiter is backed by Redis, which the tests do not need
+        self.limiter_enabled = api.limiter.enabled
+        api.limiter.enabled = False
+        self.app = app.test_client()
+
+    def tearDown(self):
+        api.limiter.enabled = self.limiter_enabled
+        
+    def test_valid_url(self):
+        pages = {
+            'http://example.com': '<a href="/a">a</a><a href="mailto:me@example.com">m</a>',
+            'http://example.com/a': '<a href="/">home</a><a href="/b">b</a>',
+        }
+
+        async def fake_fetch(session, cache, url):
+            return pages.get(url)
+
+        with mock.patch('api.coalesced_fetch', fake_fetch):
+            response = self.app.post('/api/crawl',
+                                   json={'url': 'http://example.com', 'depth': 1})
+            body = response.get_data()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        records = sorted((orjson.loads(line) for line in body.splitlines()),
+                         key=lambda record: record['url'])
+        self.assertEqual(records, [
+            {'url': 'http://example.com', 'depth': 0, 'links': ['http://example.com/a']},
+            {'url': 'http://example.com/a', 'depth': 1,
+             'links': ['http://example.com/', 'http://example.com/b']},
+        ])
+        
+    def test_invalid_url(self):
+        response = self.app.post('/api/crawl',
+                               json={'url': 'invalid-url', 'depth': 1})
+        self.assertEqual(response.status_code, 400)
+        
+    def test_invalid_depth(self):
+        response = self.app.post('/api/crawl',
+                               json={'url': 'http://example.com', 'depth': 0})
+        self.assertEqual(response.status_code, 400)
+        
+    def test_invalid_json(self):
+        response = self.app.post('/api/crawl', data='{not json',
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+class TestParseLinks(unittest.TestCase):
+    base_url = 'http://example.com/dir/page'
+
+    def test_resolves_relative_links_against_page(self):
+        html = '<a href="/a">a</a><a href="b">b</a><a href="https://other.com/c">c</a>'
+        self.assertEqual(api.parse_links(html, self.base_url),
+                         ['http://example.com/a', 'http://example.com/dir/b', 'https://other.com/c'])
+
+    def test_honours_base_href(self):
+        html = '<head><base href="/root/"></head><a href="x">x</a>'
+        self.assertEqual(api.parse_links(html, self.base_url), ['http://example.com/root/x'])
+
+        html = '<head><base href="https://other.com/sub/"></head><a href="x">x</a>'
+        self.assertEqual(api.parse_links(html, self.base_url), ['https://other.com/sub/x'])
+
+    def test_strips_whitespace_around_href(self):
+        html = '<a href="  /a\n">a</a>'
+        self.assertEqual(api.parse_links(html, self.base_url), ['http://example.com/a'])
+
+    def test_skips_empty_hrefs(self):
+        html = '<a href>a</a><a href="">b</a><a>c</a>'
+        self.assertEqual(api.parse_links(html, self.base_url), [])
+
+    def test_skips_non_http_links(self):
+        html = ('<a href="javascript:void(0)">a</a><a href="mailto:me@example.com">b</a>'
+                '<a href="ftp://example.com/file">c</a><a href="tel:123">d</a>')
+        self.assertEqual(api.parse_links(html, self.base_url), [])
+
+    def test_is_crawlable(self):
+        self.assertTrue(api.is_crawlable('http://example.com'))
+        self.assertTrue(api.is_crawlable('https://example.com/a?b=c'))
+        self.assertFalse(api.is_crawlable('/relative/path'))
+        self.assertFalse(api.is_crawlable('https://?query'))
+        self.assertFalse(api.is_crawlable('mailto:me@example.com'))
+        self.assertFalse(api.is_crawlable('javascript:void(0)'))
+
+class FakeResponse:
+    def __init__(self, body, content_type='text/html', charset=None, content_length=None):
+        self.body = body
+        self.headers = {'Content-Type': content_type}
+        self.charset = charset
+        self.content_length = content_length
+        self.content = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+class TestFetch(unittest.IsolatedAsyncioTestCase):
+    async def test_decodes_declared_charset(self):
+        response = FakeResponse('<p>caf\u00e9</p>'.encode('latin-1'), charset='latin-1')
+        html = await api.fetch(FakeSession(response), 'http://example.com')
+        self.assertEqual(html, '<p>caf\u00e9</p>')
+
+    async def test_unknown_charset_falls_back_to_utf8(self):
+        response = FakeResponse('<p>caf\u00e9</p>'.encode('utf-8'), charset='utf8mb4')
+        html = await api.fetch(FakeSession(response), 'http://example.com')
+        self.assertEqual(html, '<p>caf\u00e9</p>')
+
+    async def test_skips_non_html(self):
+        response = FakeResponse(b'%PDF-1.4', content_type='application/pdf')
+        self.assertIsNone(await api.fetch(FakeSession(response), 'http://example.com/a.pdf'))
+
+    async def test_skips_oversized_content_length(self):
+        response = FakeResponse(b'<p>big</p>', content_length=api.MAX_PAGE_BYTES + 1)
+        self.assertIsNone(await api.fetch(FakeSession(response), 'http://example.com/big'))
+
+    async def test_truncates_body_to_max_page_bytes(self):
+        with mock.patch('api.MAX_PAGE_BYTES', 8):
+            response = FakeResponse(b'<p>0123456789</p>')
+            html = await api.fetch(FakeSession(response), 'http://example.com')
+        self.assertEqual(html, '<p>01234')
+
+class TestCoalescedFetch(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_crawl_does_not_fail_other_waiters(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_fetch(session, cache, url):
+            started.set()
+            await release.wait()
+            return '<html></html>'
+
+        with mock.patch('api.cached_fetch', slow_fetch):
+            first = asyncio.create_task(api.coalesced_fetch(None, None, 'http://example.com/slow'))
+            await started.wait()
+            second = asyncio.create_task(api.coalesced_fetch(None, None, 'http://example.com/slow'))
+            await asyncio.sleep(0)
+
+            first.cancel()
+            release.set()
+
+            self.assertEqual(await second, '<html></html>')
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+        self.assertNotIn('http://example.com/slow', api._inflight_fetches)
+
+if __name__ == '__main__':
+    unittest.main()